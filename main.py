@@ -1,15 +1,21 @@
 import os
-import json
+import sys
 import asyncio
 import logging
+import time
 from datetime import datetime
+from functools import wraps
 from typing import Set, Dict, Optional, List
 
 import asyncpg
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect, HTTPException
+import orjson
+from aiolimiter import AsyncLimiter
+from fastapi import FastAPI, WebSocket, WebSocketDisconnect, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse, Response
 from pydantic import BaseModel
-from aiogram import Bot, Dispatcher, types
+from aiogram import Bot, Dispatcher, F, types
+from aiogram.client.session.aiohttp import AiohttpSession
 from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
 from aiohttp import web
@@ -20,15 +26,30 @@ def serialize_datetime(obj):
         return obj.isoformat()
     raise TypeError(f"Object of type {type(obj)} is not JSON serializable")
 
+def record_to_dict(record) -> dict:
+    """Конвертация записи БД в dict с datetime в виде строк"""
+    data = dict(record)
+    for key in ('created_at', 'updated_at'):
+        if data.get(key):
+            data[key] = data[key].isoformat()
+    return data
+
 # Настройки
 BOT_TOKEN = os.getenv("BOT_TOKEN")
 DATABASE_URL = os.getenv("DATABASE_URL")
 MODERATION_CHAT_ID = int(os.getenv("MODERATION_CHAT_ID"))
 WEBHOOK_URL = os.getenv("WEBHOOK_URL", "https://your-domain.com/webhook")
+# max_connections в Postgres должен покрывать число воркеров * DB_MAX_SIZE
+DB_MIN_SIZE = int(os.getenv("DB_MIN_SIZE", "5"))
+DB_MAX_SIZE = int(os.getenv("DB_MAX_SIZE", "20"))
 
 # Инициализация
-app = FastAPI()
-bot = Bot(token=BOT_TOKEN)
+app = FastAPI(default_response_class=ORJSONResponse)
+# Одна сессия (и один пул keep-alive соединений) на весь процесс
+bot = Bot(
+    token=BOT_TOKEN,
+    session=AiohttpSession(json_loads=orjson.loads),
+)
 dp = Dispatcher()
 
 # CORS
@@ -40,8 +61,123 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Пул соединений с БД (создается при запуске)
+db_pool: Optional[asyncpg.Pool] = None
+
+# Кэш ленты постов: короткий TTL + поколение, которое сбрасывается при изменении постов
+POSTS_CACHE_TTL = 5.0
+posts_cache: Optional[List[dict]] = None
+posts_cache_expires = 0.0
+posts_cache_generation = 0
+# Текущая загрузка ленты из БД, общая для одновременных промахов кэша
+posts_loading_task: Optional[asyncio.Task] = None
+posts_loading_generation = -1
+
+# Частые запросы: одинаковый текст попадает в кэш prepared statements соединения
+SQL_GET_USER = "SELECT * FROM users WHERE telegram_id = $1"
+SQL_GET_POST = "SELECT * FROM posts WHERE id = $1"
+# Создание поста: автор должен существовать, не быть забаненным и не превышать лимит;
+# строка автора блокируется, чтобы параллельные создания не обошли лимит
+SQL_CREATE_POST = """
+    WITH author AS (
+        SELECT username, full_name FROM users
+        WHERE telegram_id = $1
+          AND status IS DISTINCT FROM 'banned'
+          AND COALESCE(cardinality(posts), 0) < post_limit
+        FOR UPDATE
+    ), inserted AS (
+        INSERT INTO posts (telegram_id, description, category, city, gender, age, date_tag, username, full_name, avatar_url)
+        SELECT $1, $2, $3, $4, $5, $6, $7, username, full_name,
+               'https://t.me/i/userpic/160/' || username || '.jpg'
+        FROM author
+        RETURNING *
+    ), appended AS (
+        UPDATE users SET posts = array_append(posts, inserted.id)
+        FROM inserted WHERE users.telegram_id = inserted.telegram_id
+    )
+    SELECT * FROM inserted
+"""
+# Удаление поста из списков пользователей; переписываем только строки, где он есть
+SQL_REMOVE_POST_REFS = (
+    "UPDATE users SET posts = array_remove(posts, $1), "
+    "favorites = array_remove(favorites, $1), "
+    "likes = array_remove(likes, $1), "
+    "reports = array_remove(reports, $1), "
+    "hidden = array_remove(hidden, $1) "
+    "WHERE posts @> ARRAY[$1::integer] OR favorites @> ARRAY[$1::integer] "
+    "OR likes @> ARRAY[$1::integer] OR reports @> ARRAY[$1::integer] "
+    "OR hidden @> ARRAY[$1::integer]"
+)
+
 # WebSocket соединения
-active_connections: Set[WebSocket] = set()
+# Сокет -> telegram_id пользователя (None до sync)
+active_connections: Dict[WebSocket, Optional[int]] = {}
+# telegram_id -> сокеты пользователя, для адресных сообщений
+user_connections: Dict[int, Set[WebSocket]] = {}
+# Сокет -> (очередь исходящих кадров, задача-писатель)
+# Клиент с отставанием в WS_OUTBOX_SIZE кадров отключается; пакет кадров
+# (хард бан, окно post_action) принимается целиком, если клиент не отстал
+WS_OUTBOX_SIZE = 256
+connection_outboxes: Dict[WebSocket, tuple] = {}
+# Фоновые задачи без владельца (модерация, закрытие медленных сокетов)
+background_tasks: Set[asyncio.Task] = set()
+# Сколько клиентов обходит рассылка до передачи управления циклу
+BROADCAST_BATCH_SIZE = 50
+
+# Обновления постов (лайки и т.п.) копятся коротким окном и рассылаются
+# последним состоянием каждого поста
+POST_ACTION_FLUSH_DELAY = 0.05
+pending_post_actions: Dict[int, dict] = {}
+post_actions_flush_task: Optional[asyncio.Task] = None
+
+# Действия, запрещенные забаненным пользователям
+BANNED_USER_ACTIONS = frozenset({"like", "report", "delete"})
+
+# Постоянные ответы сериализуются один раз при импорте
+NOTIFICATIONS_UPDATED_FRAME = orjson.dumps({
+    "type": "notifications_updated",
+    "data": {"status": "success"}
+}).decode()
+
+# Уведомления пользователям уходят через очередь, которую разбирают
+# TELEGRAM_SEND_CONCURRENCY фоновых обработчиков
+TELEGRAM_SEND_CONCURRENCY = 10
+notify_queue: asyncio.Queue = asyncio.Queue(maxsize=10_000)
+notify_workers: List[asyncio.Task] = []
+# Telegram допускает ~30 сообщений в секунду на бота, держим запас
+telegram_rate_limiter = AsyncLimiter(25, 1)
+
+# Тексты уведомлений пользователям
+NOTIFICATION_TEXTS = {
+    "like": "👍 Вам поставили лайк на объявление #{post_id}\nОт: @{username}",
+    "new_post": "🆕 Новое объявление!\n\n{description}\n\nОт: {full_name}",
+    "post_deleted": "❌ Ваше объявление удалено из-за нарушения",
+    "banned": "🚫 Ваш аккаунт заблокирован",
+    "hardbanned": "💀 Ваш аккаунт заблокирован и все объявления удалены",
+    "unbanned": "✅ Вы разблокированы",
+    "limit": "📊 Новый лимит объявлений: {limit}",
+}
+
+# Поля фильтров подписки: ключ фильтра -> колонка поста
+SUBSCRIPTION_FILTER_FIELDS = (
+    ("category", "category"),
+    ("city", "city"),
+    ("gender", "gender"),
+    ("age", "age"),
+    ("date", "date_tag"),
+)
+
+# Фильтр пустой или "Все" — совпадает с любым постом, иначе значение должно совпасть с колонкой поста
+SUBSCRIBERS_SQL = (
+    "SELECT telegram_id FROM users "
+    "WHERE telegram_id <> $1 "
+    "AND jsonb_typeof(notifications_filters) = 'object' "
+    "AND notifications_filters <> '{}'::jsonb "
+    + "".join(
+        f"AND COALESCE(notifications_filters->>'{filter_key}', '') IN ('', 'Все', ${i + 2}) "
+        for i, (filter_key, _) in enumerate(SUBSCRIPTION_FILTER_FIELDS)
+    )
+)
 
 # Модели данных
 class UserSync(BaseModel):
@@ -81,97 +217,213 @@ class NotificationSettings(BaseModel):
     filters: dict
 
 # База данных
+# Схема и миграции: выполняются одним пакетом (simple query protocol)
+SCHEMA_SQL = '''
+    CREATE TABLE IF NOT EXISTS users (
+        telegram_id BIGINT PRIMARY KEY,
+        username TEXT,
+        full_name TEXT,
+        posts INTEGER[] DEFAULT '{}',
+        hidden INTEGER[] DEFAULT '{}',
+        favorites INTEGER[] DEFAULT '{}',
+        likes INTEGER[] DEFAULT '{}',
+        reports INTEGER[] DEFAULT '{}',
+        post_limit INTEGER DEFAULT 10,
+        status TEXT DEFAULT 'live',
+        subscriptions JSONB DEFAULT '{}',
+        notifications_likes BOOLEAN DEFAULT true,
+        notifications_system BOOLEAN DEFAULT true,
+        notifications_filters JSONB DEFAULT '{}',
+        created_at TIMESTAMP DEFAULT NOW(),
+        updated_at TIMESTAMP DEFAULT NOW()
+    );
+
+    -- Добавляем новые колонки для существующих пользователей
+    ALTER TABLE users ADD COLUMN IF NOT EXISTS notifications_likes BOOLEAN DEFAULT true;
+    ALTER TABLE users ADD COLUMN IF NOT EXISTS notifications_system BOOLEAN DEFAULT true;
+    ALTER TABLE users ADD COLUMN IF NOT EXISTS notifications_filters JSONB DEFAULT '{}';
+    ALTER TABLE users ADD COLUMN IF NOT EXISTS avatar_url TEXT;
+
+    CREATE TABLE IF NOT EXISTS posts (
+        id SERIAL PRIMARY KEY,
+        telegram_id BIGINT,
+        description TEXT,
+        category TEXT,
+        city TEXT,
+        gender TEXT,
+        age TEXT,
+        date_tag TEXT,
+        likes_count INTEGER DEFAULT 0,
+        reports_count INTEGER DEFAULT 0,
+        username TEXT,
+        full_name TEXT,
+        avatar_url TEXT,
+        created_at TIMESTAMP DEFAULT NOW(),
+        updated_at TIMESTAMP DEFAULT NOW()
+    );
+
+    -- Лента отдается отсортированной по дате
+    CREATE INDEX IF NOT EXISTS idx_posts_created_at ON posts (created_at DESC);
+
+    -- Посты автора: хард бан удаляет все посты пользователя
+    CREATE INDEX IF NOT EXISTS idx_posts_telegram_id ON posts (telegram_id);
+'''
+
 async def init_db():
-    conn = await asyncpg.connect(DATABASE_URL)
-    
-    # Таблица пользователей
-    await conn.execute('''
-        CREATE TABLE IF NOT EXISTS users (
-            telegram_id BIGINT PRIMARY KEY,
-            username TEXT,
-            full_name TEXT,
-            posts INTEGER[] DEFAULT '{}',
-            hidden INTEGER[] DEFAULT '{}',
-            favorites INTEGER[] DEFAULT '{}',
-            likes INTEGER[] DEFAULT '{}',
-            reports INTEGER[] DEFAULT '{}',
-            post_limit INTEGER DEFAULT 10,
-            status TEXT DEFAULT 'live',
-            subscriptions JSONB DEFAULT '{}',
-            notifications_likes BOOLEAN DEFAULT true,
-            notifications_system BOOLEAN DEFAULT true,
-            notifications_filters JSONB DEFAULT '{}',
-            created_at TIMESTAMP DEFAULT NOW(),
-            updated_at TIMESTAMP DEFAULT NOW()
-        )
-    ''')
-    
-    # Добавляем новые колонки для существующих пользователей
+    async with db_pool.acquire() as conn:
+        # Схема применяется целиком или не применяется вовсе
+        async with conn.transaction():
+            await conn.execute(SCHEMA_SQL)
+
+def run_in_background(coro):
+    """Запуск задачи без ожидания; ссылка хранится, пока задача не завершится"""
+    task = asyncio.create_task(coro)
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+
+# WebSocket менеджер
+def enqueue_frame(websocket: WebSocket, payload: str):
+    """Постановка кадра в очередь отправки клиента, без ожидания сети"""
+    enqueue_frames(websocket, (payload,))
+
+def enqueue_frames(websocket: WebSocket, payloads):
+    """Постановка пакета кадров в очередь клиента по порядку"""
+    outbox = connection_outboxes.get(websocket)
+    if outbox is None:
+        return
+    queue = outbox[0]
+    if queue.qsize() < WS_OUTBOX_SIZE:
+        for payload in payloads:
+            queue.put_nowait(payload)
+    else:
+        # Клиент не успевает читать: отключаем, чтобы не копить для него кадры
+        drop_connection(websocket)
+        run_in_background(close_connection(websocket, 1013))
+
+async def close_connection(websocket: WebSocket, code: int):
+    """Закрытие сокета; уже закрытое соединение не считается ошибкой"""
     try:
-        await conn.execute('ALTER TABLE users ADD COLUMN IF NOT EXISTS notifications_likes BOOLEAN DEFAULT true')
-        await conn.execute('ALTER TABLE users ADD COLUMN IF NOT EXISTS notifications_system BOOLEAN DEFAULT true') 
-        await conn.execute('ALTER TABLE users ADD COLUMN IF NOT EXISTS notifications_filters JSONB DEFAULT \'{}\'')
-        await conn.execute('ALTER TABLE users ADD COLUMN IF NOT EXISTS avatar_url TEXT')
-    except:
+        await websocket.close(code=code)
+    except Exception:
         pass
-    
-    # Таблица постов
-    await conn.execute('''
-        CREATE TABLE IF NOT EXISTS posts (
-            id SERIAL PRIMARY KEY,
-            telegram_id BIGINT,
-            description TEXT,
-            category TEXT,
-            city TEXT,
-            gender TEXT,
-            age TEXT,
-            date_tag TEXT,
-            likes_count INTEGER DEFAULT 0,
-            reports_count INTEGER DEFAULT 0,
-            username TEXT,
-            full_name TEXT,
-            avatar_url TEXT,
-            created_at TIMESTAMP DEFAULT NOW(),
-            updated_at TIMESTAMP DEFAULT NOW()
-        )
-    ''')
-    
-    await conn.close()
 
-# WebSocket менеджер
+def register_user_connection(websocket: WebSocket, telegram_id: int):
+    """Привязка сокета к пользователю после sync"""
+    unregister_user_connection(websocket)
+    active_connections[websocket] = telegram_id
+    user_connections.setdefault(telegram_id, set()).add(websocket)
+
+def unregister_user_connection(websocket: WebSocket):
+    """Отвязка сокета от пользователя"""
+    telegram_id = active_connections.get(websocket)
+    sockets = user_connections.get(telegram_id)
+    if sockets is not None:
+        sockets.discard(websocket)
+        if not sockets:
+            del user_connections[telegram_id]
+
+def drop_connection(websocket: WebSocket):
+    """Удаление соединения из рассылки и остановка его писателя"""
+    unregister_user_connection(websocket)
+    active_connections.pop(websocket, None)
+    outbox = connection_outboxes.pop(websocket, None)
+    if outbox:
+        outbox[1].cancel()
+
+async def connection_writer(websocket: WebSocket, queue: asyncio.Queue):
+    """Отправка кадров из очереди клиента по порядку"""
+    try:
+        while True:
+            payload = await queue.get()
+            await websocket.send_text(payload)
+    except asyncio.CancelledError:
+        raise
+    except Exception:
+        drop_connection(websocket)
+
+def send_message(websocket: WebSocket, message: dict):
+    """Отправка сообщения одному клиенту (orjson вместо json.dumps Starlette)"""
+    enqueue_frame(websocket, orjson.dumps(message).decode())
+
 async def broadcast_message(message: dict):
     """Отправка сообщения всем подключенным клиентам"""
     if active_connections:
-        disconnected = set()
-        for connection in active_connections:
-            try:
-                await connection.send_json(message)
-            except:
-                disconnected.add(connection)
-        
-        # Удаляем отключенные соединения
-        active_connections.difference_update(disconnected)
+        # Сериализуем один раз для всех клиентов
+        await broadcast_frames((orjson.dumps(message).decode(),))
+
+async def broadcast_frames(payloads):
+    """Отправка пакета готовых кадров всем подключенным клиентам"""
+    if active_connections:
+        # Снимок: переполненные клиенты удаляются прямо во время обхода
+        connections = tuple(active_connections)
+        for i, connection in enumerate(connections, 1):
+            enqueue_frames(connection, payloads)
+            # При большом числе клиентов отдаем цикл другим задачам между пачками
+            if i % BROADCAST_BATCH_SIZE == 0:
+                await asyncio.sleep(0)
+
+def send_to_user(telegram_id: int, message: dict):
+    """Отправка сообщения только сокетам одного пользователя"""
+    connections = user_connections.get(telegram_id)
+    if connections:
+        payload = orjson.dumps(message).decode()
+        for connection in tuple(connections):
+            enqueue_frame(connection, payload)
+
+def queue_post_action(post: dict):
+    """Постановка обновления поста в очередь рассылки post_action"""
+    global post_actions_flush_task
+    pending_post_actions[post["id"]] = post
+    if post_actions_flush_task is None:
+        post_actions_flush_task = asyncio.create_task(flush_post_actions())
+
+def discard_post_action(post_id: int):
+    """Отмена отложенного post_action: пост изменен или удален, старая версия
+    не должна прийти клиентам после post_updated/post_deleted"""
+    pending_post_actions.pop(post_id, None)
+
+async def flush_post_actions():
+    """Рассылка накопленных за окно обновлений постов"""
+    global pending_post_actions, post_actions_flush_task
+    await asyncio.sleep(POST_ACTION_FLUSH_DELAY)
+    batch, pending_post_actions = pending_post_actions, {}
+    post_actions_flush_task = None
+    payloads = [
+        orjson.dumps({"type": "post_action", "data": post}).decode()
+        for post in batch.values()
+    ]
+    # Кадры ставятся в очереди без передачи управления циклу, чтобы между
+    # ними не вклинились post_updated/post_deleted для тех же постов
+    for connection in tuple(active_connections):
+        enqueue_frames(connection, payloads)
 
 # API endpoints
 @app.websocket("/ws")
 async def websocket_endpoint(websocket: WebSocket):
     await websocket.accept()
-    active_connections.add(websocket)
+    # Все отправки клиенту идут через его очередь и одного писателя
+    outbox = asyncio.Queue()
+    writer = asyncio.create_task(connection_writer(websocket, outbox))
+    connection_outboxes[websocket] = (outbox, writer)
+    active_connections[websocket] = None
     
     try:
         while True:
-            data = await websocket.receive_json()
+            data = orjson.loads(await websocket.receive_text())
             
             if data["type"] == "sync":
                 user_data = UserSync(**data["data"])
-                user_info = await sync_user(user_data)
-                await websocket.send_json({
+                register_user_connection(websocket, user_data.telegram_id)
+                # Пользователь и лента не зависят друг от друга, запрашиваем параллельно
+                user_info, all_posts = await asyncio.gather(
+                    sync_user(user_data), get_all_posts()
+                )
+                send_message(websocket, {
                     "type": "user_synced",
                     "data": user_info
                 })
                 
-                all_posts = await get_all_posts()
-                await websocket.send_json({
+                send_message(websocket, {
                     "type": "posts_loaded", 
                     "data": all_posts
                 })
@@ -187,6 +439,7 @@ async def websocket_endpoint(websocket: WebSocket):
             elif data["type"] == "update_post":
                 post_data = PostUpdate(**data["data"])
                 updated_post = await update_post(post_data)
+                discard_post_action(updated_post["id"])
                 await broadcast_message({
                     "type": "post_updated",
                     "data": updated_post
@@ -198,510 +451,366 @@ async def websocket_endpoint(websocket: WebSocket):
                 
                 # Если это удаление собственного поста
                 if action_data.action == "delete":
+                    discard_post_action(action_data.post_id)
                     await broadcast_message({
                         "type": "post_deleted",
                         "data": {"post_id": action_data.post_id}
                     })
                     # Обновляем информацию о пользователе
                     user_info = await get_user_info(action_data.telegram_id)
-                    await websocket.send_json({
+                    send_message(websocket, {
                         "type": "user_updated",
                         "data": user_info
                     })
                 else:
-                    await broadcast_message({
-                        "type": "post_action",
-                        "data": result
-                    })
+                    queue_post_action(result)
                     
             elif data["type"] == "update_notifications":
                 notif_data = NotificationSettings(**data["data"])
                 await update_notification_settings(notif_data)
-                await websocket.send_json({
-                    "type": "notifications_updated",
-                    "data": {"status": "success"}
-                })
+                enqueue_frame(websocket, NOTIFICATIONS_UPDATED_FRAME)
                 
     except WebSocketDisconnect:
-        active_connections.discard(websocket)
+        pass
+    finally:
+        # Соединение удаляется при любом завершении, иначе оно остается в наборе навсегда
+        drop_connection(websocket)
 
 # Функции работы с БД
 async def get_user_info(telegram_id: int) -> dict:
     """Получение актуальной информации о пользователе"""
-    conn = await asyncpg.connect(DATABASE_URL)
-    user = await conn.fetchrow("SELECT * FROM users WHERE telegram_id = $1", telegram_id)
-    await conn.close()
+    async with db_pool.acquire() as conn:
+        user = await conn.fetchrow(SQL_GET_USER, telegram_id)
     
     if user:
-        user_info = dict(user)
-        # Конвертируем datetime в строки
-        if 'created_at' in user_info and user_info['created_at']:
-            user_info['created_at'] = user_info['created_at'].isoformat()
-        if 'updated_at' in user_info and user_info['updated_at']:
-            user_info['updated_at'] = user_info['updated_at'].isoformat()
-        return user_info
+        return record_to_dict(user)
     return {}
 
 async def update_notification_settings(notif_data: NotificationSettings):
     """Обновление настроек уведомлений"""
-    conn = await asyncpg.connect(DATABASE_URL)
-    
-    await conn.execute(
-        """UPDATE users SET 
-           notifications_likes = $1, 
-           notifications_system = $2, 
-           notifications_filters = $3
-           WHERE telegram_id = $4""",
-        notif_data.likes, notif_data.system, 
-        json.dumps(notif_data.filters), notif_data.telegram_id
-    )
-    
-    await conn.close()
-
-async def sync_user(user_data: UserSync) -> dict:
-    conn = await asyncpg.connect(DATABASE_URL)
-    
-    avatar_url = f"https://t.me/i/userpic/160/{user_data.username}.jpg"
-    
-    user = await conn.fetchrow(
-        "SELECT * FROM users WHERE telegram_id = $1", 
-        user_data.telegram_id
-    )
-    
-    if user:
+    async with db_pool.acquire() as conn:
         await conn.execute(
-            """UPDATE users SET username = $1, full_name = $2, avatar_url = $3, updated_at = NOW() 
+            """UPDATE users SET 
+               notifications_likes = $1, 
+               notifications_system = $2, 
+               notifications_filters = $3
                WHERE telegram_id = $4""",
-            user_data.username, user_data.full_name, avatar_url, user_data.telegram_id
+            notif_data.likes, notif_data.system, 
+            notif_data.filters, notif_data.telegram_id
         )
-        user_info = dict(user)
-        # Конвертируем datetime в строки
-        if 'created_at' in user_info and user_info['created_at']:
-            user_info['created_at'] = user_info['created_at'].isoformat()
-        if 'updated_at' in user_info and user_info['updated_at']:
-            user_info['updated_at'] = user_info['updated_at'].isoformat()
-    else:
-        # Создаем нового пользователя
-        await conn.execute(
-            """INSERT INTO users (telegram_id, username, full_name, avatar_url) 
-               VALUES ($1, $2, $3, $4)""",
-            user_data.telegram_id, user_data.username, user_data.full_name, avatar_url
-        )
-        user_info = {
-            "telegram_id": user_data.telegram_id,
-            "username": user_data.username,
-            "full_name": user_data.full_name,
-            "avatar_url": avatar_url,
-            "posts": [],
-            "hidden": [],
-            "favorites": [],
-            "likes": [],
-            "reports": [],
-            "post_limit": 10,
-            "status": "live",
-            "subscriptions": {},
-            "notifications_likes": True,
-            "notifications_system": True,
-            "notifications_filters": {}
-        }
-    
-    await conn.close()
-    return user_info
+
+async def sync_user(user_data: UserSync) -> dict:
     """Синхронизация пользователя с БД"""
-    conn = await asyncpg.connect(DATABASE_URL)
-    
-    # Проверяем существование пользователя
-    user = await conn.fetchrow(
-        "SELECT * FROM users WHERE telegram_id = $1", 
-        user_data.telegram_id
-    )
+    avatar_url = f"https://t.me/i/userpic/160/{user_data.username}.jpg"
     
-    if user:
-        # Обновляем данные если изменились
-        await conn.execute(
-            """UPDATE users SET username = $1, full_name = $2, updated_at = NOW() 
-               WHERE telegram_id = $3""",
-            user_data.username, user_data.full_name, user_data.telegram_id
-        )
-        user_info = dict(user)
-        # Конвертируем datetime в строки
-        if 'created_at' in user_info and user_info['created_at']:
-            user_info['created_at'] = user_info['created_at'].isoformat()
-        if 'updated_at' in user_info and user_info['updated_at']:
-            user_info['updated_at'] = user_info['updated_at'].isoformat()
-    else:
-        # Создаем нового пользователя
-        await conn.execute(
-            """INSERT INTO users (telegram_id, username, full_name) 
-               VALUES ($1, $2, $3)""",
-            user_data.telegram_id, user_data.username, user_data.full_name
+    async with db_pool.acquire() as conn:
+        # Создаем нового или обновляем существующего пользователя за один запрос
+        user = await conn.fetchrow(
+            """INSERT INTO users (telegram_id, username, full_name, avatar_url)
+               VALUES ($1, $2, $3, $4)
+               ON CONFLICT (telegram_id) DO UPDATE SET
+                   username = EXCLUDED.username,
+                   full_name = EXCLUDED.full_name,
+                   avatar_url = EXCLUDED.avatar_url,
+                   updated_at = NOW()
+               RETURNING *""",
+            user_data.telegram_id, user_data.username, user_data.full_name, avatar_url
         )
-        user_info = {
-            "telegram_id": user_data.telegram_id,
-            "username": user_data.username,
-            "full_name": user_data.full_name,
-            "posts": [],
-            "hidden": [],
-            "favorites": [],
-            "likes": [],
-            "reports": [],
-            "post_limit": 10,
-            "status": "live",
-            "subscriptions": {}
-        }
     
-    await conn.close()
-    return user_info
+    return record_to_dict(user)
 
 async def create_post(post_data: PostCreate) -> dict:
     """Создание нового поста"""
-    conn = await asyncpg.connect(DATABASE_URL)
-    
-    # Проверяем лимиты и статус пользователя
-    user = await conn.fetchrow(
-        "SELECT post_limit, status, posts, username, full_name FROM users WHERE telegram_id = $1",
-        post_data.telegram_id
-    )
-    
-    if not user or user["status"] == "banned":
-        await conn.close()
-        raise HTTPException(status_code=403, detail="User banned or not found")
-    
-    if len(user["posts"]) >= user["post_limit"]:
-        await conn.close()
-        raise HTTPException(status_code=403, detail="Post limit exceeded")
-    
-    # Создаем пост
-    post_id = await conn.fetchval(
-        """INSERT INTO posts (telegram_id, description, category, city, gender, age, date_tag, username, full_name, avatar_url)
-        VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9, $10) RETURNING id""",
-        post_data.telegram_id, post_data.description, post_data.category,
-        post_data.city, post_data.gender, post_data.age, post_data.date,
-        user["username"], user["full_name"], 
-        user.get("avatar_url", f"https://t.me/i/userpic/160/{user['username']}.jpg")
-    )
-    
-    # Обновляем список постов пользователя
-    new_posts = user["posts"] + [post_id]
-    await conn.execute(
-        "UPDATE users SET posts = $1 WHERE telegram_id = $2",
-        new_posts, post_data.telegram_id
-    )
-    
-    # Получаем созданный пост
-    post = await conn.fetchrow("SELECT * FROM posts WHERE id = $1", post_id)
-    await conn.close()
-    
-    # Конвертируем datetime в строки
-    post_dict = dict(post)
-    if 'created_at' in post_dict and post_dict['created_at']:
-        post_dict['created_at'] = post_dict['created_at'].isoformat()
-    if 'updated_at' in post_dict and post_dict['updated_at']:
-        post_dict['updated_at'] = post_dict['updated_at'].isoformat()
+    async with db_pool.acquire() as conn:
+        # Проверка лимита и статуса, вставка и обновление списка постов одним запросом
+        post = await conn.fetchrow(
+            SQL_CREATE_POST,
+            post_data.telegram_id, post_data.description, post_data.category,
+            post_data.city, post_data.gender, post_data.age, post_data.date
+        )
+        
+        if not post:
+            # Редкий путь: выясняем, почему пост не создан
+            user = await conn.fetchrow(
+                "SELECT status FROM users WHERE telegram_id = $1",
+                post_data.telegram_id
+            )
+            if not user or user["status"] == "banned":
+                raise HTTPException(status_code=403, detail="User banned or not found")
+            raise HTTPException(status_code=403, detail="Post limit exceeded")
+        
+        invalidate_posts_cache()
     
-    # Отправляем в модерацию
-    await send_to_moderation(post_dict, "new")
+    post_dict = record_to_dict(post)
     
-    # Отправляем уведомления подписчикам
-    await send_notifications_to_subscribers(post_dict)
+    # Модерация и уведомления подписчиков не задерживают ответ клиенту
+    run_in_background(send_to_moderation(post_dict, "new"))
+    run_in_background(send_notifications_to_subscribers(post_dict))
     
     return post_dict
 
 async def update_post(post_data: PostUpdate) -> dict:
     """Обновление поста"""
-    conn = await asyncpg.connect(DATABASE_URL)
-    
-    # Проверяем права
-    post = await conn.fetchrow(
-        "SELECT * FROM posts WHERE id = $1 AND telegram_id = $2",
-        post_data.post_id, post_data.telegram_id
-    )
-    
-    if not post:
-        await conn.close()
-        raise HTTPException(status_code=404, detail="Post not found")
-    
-    # Проверяем статус пользователя
-    user = await conn.fetchrow(
-        "SELECT status FROM users WHERE telegram_id = $1",
-        post_data.telegram_id
-    )
-    
-    if user["status"] == "banned":
-        await conn.close()
-        raise HTTPException(status_code=403, detail="User banned")
-    
-    # Обновляем пост
-    await conn.execute(
-        """UPDATE posts SET description = $1, category = $2, city = $3, 
-           gender = $4, age = $5, date_tag = $6, updated_at = NOW()
-           WHERE id = $7""",
-        post_data.description, post_data.category, post_data.city,
-        post_data.gender, post_data.age, post_data.date, post_data.post_id
-    )
-    
-    # Получаем обновленный пост
-    updated_post = await conn.fetchrow("SELECT * FROM posts WHERE id = $1", post_data.post_id)
-    await conn.close()
+    async with db_pool.acquire() as conn:
+        # Проверяем права и статус пользователя одним запросом
+        post = await conn.fetchrow(
+            """SELECT p.id, u.status FROM posts p
+               LEFT JOIN users u ON u.telegram_id = p.telegram_id
+               WHERE p.id = $1 AND p.telegram_id = $2""",
+            post_data.post_id, post_data.telegram_id
+        )
+
+        if not post:
+            raise HTTPException(status_code=404, detail="Post not found")
+
+        if post["status"] == "banned":
+            raise HTTPException(status_code=403, detail="User banned")
+        
+        # Обновляем пост и получаем его новую версию
+        updated_post = await conn.fetchrow(
+            """UPDATE posts SET description = $1, category = $2, city = $3, 
+               gender = $4, age = $5, date_tag = $6, updated_at = NOW()
+               WHERE id = $7
+               RETURNING *""",
+            post_data.description, post_data.category, post_data.city,
+            post_data.gender, post_data.age, post_data.date, post_data.post_id
+        )
+        invalidate_posts_cache()
     
-    # Конвертируем datetime в строки
-    post_dict = dict(updated_post)
-    if 'created_at' in post_dict and post_dict['created_at']:
-        post_dict['created_at'] = post_dict['created_at'].isoformat()
-    if 'updated_at' in post_dict and post_dict['updated_at']:
-        post_dict['updated_at'] = post_dict['updated_at'].isoformat()
+    post_dict = record_to_dict(updated_post)
     
-    # Отправляем в модерацию
-    await send_to_moderation(post_dict, "updated")
+    # Модерация не задерживает ответ клиенту
+    run_in_background(send_to_moderation(post_dict, "updated"))
     
     return post_dict
 
 async def handle_user_action(action_data: UserAction) -> dict:
     """Обработка действий пользователя"""
-    conn = await asyncpg.connect(DATABASE_URL)
-    
-    user = await conn.fetchrow(
-        "SELECT * FROM users WHERE telegram_id = $1",
-        action_data.telegram_id
-    )
-    
-    if user["status"] == "banned" and action_data.action in ["like", "report", "delete"]:
-        await conn.close()
-        raise HTTPException(status_code=403, detail="User banned")
+    async with db_pool.acquire() as conn:
+        # Статус нужен только для действий, запрещенных при бане (имя - для
+        # уведомления о лайке); избранное и скрытие сразу идут в UPDATE
+        if action_data.action in BANNED_USER_ACTIONS:
+            user = await conn.fetchrow(
+                "SELECT status, username FROM users WHERE telegram_id = $1",
+                action_data.telegram_id
+            )
+        
+            if user["status"] == "banned":
+                raise HTTPException(status_code=403, detail="User banned")
     
-    # Обработка удаления собственного поста
-    if action_data.action == "delete":
-        # Проверяем, что пост принадлежит пользователю
-        post = await conn.fetchrow(
-            "SELECT * FROM posts WHERE id = $1 AND telegram_id = $2",
-            action_data.post_id, action_data.telegram_id
-        )
+        # Обработка удаления собственного поста
+        if action_data.action == "delete":
+            # Удаляем пост, только если он принадлежит пользователю
+            deleted_id = await conn.fetchval(
+                "DELETE FROM posts WHERE id = $1 AND telegram_id = $2 RETURNING id",
+                action_data.post_id, action_data.telegram_id
+            )
         
-        if not post:
-            await conn.close()
-            raise HTTPException(status_code=404, detail="Post not found or access denied")
+            if deleted_id is None:
+                raise HTTPException(status_code=404, detail="Post not found or access denied")
+            invalidate_posts_cache()
         
-        # Удаляем пост
-        await conn.execute("DELETE FROM posts WHERE id = $1", action_data.post_id)
+            # Удаляем из списков пользователей
+            await conn.execute(SQL_REMOVE_POST_REFS, action_data.post_id)
         
-        # Удаляем из списков пользователей
-        await conn.execute(
-            "UPDATE users SET posts = array_remove(posts, $1), "
-            "favorites = array_remove(favorites, $1), "
-            "likes = array_remove(likes, $1), "
-            "reports = array_remove(reports, $1), "
-            "hidden = array_remove(hidden, $1)",
-            action_data.post_id
-        )
-        
-        await conn.close()
-        return {"post_id": action_data.post_id, "action": "deleted"}
+            return {"post_id": action_data.post_id, "action": "deleted"}
     
-    # Обновляем пользователя для других действий
-    if action_data.action == "like":
-        if action_data.post_id in user["likes"]:
-            new_likes = [x for x in user["likes"] if x != action_data.post_id]
-            likes_change = -1
-        else:
-            new_likes = user["likes"] + [action_data.post_id]
-            likes_change = 1
-            
-        await conn.execute(
-            "UPDATE users SET likes = $1 WHERE telegram_id = $2",
-            new_likes, action_data.telegram_id
-        )
+        post = None
+        like_author_id = None
+        reported = False
         
-        # Обновляем счетчик лайков поста
-        await conn.execute(
-            "UPDATE posts SET likes_count = likes_count + $1 WHERE id = $2",
-            likes_change, action_data.post_id
-        )
+        # Обновляем пользователя для других действий
+        if action_data.action == "like":
+            # Переключаем лайк на стороне БД: +1 если лайк поставлен, -1 если снят
+            likes_change = await conn.fetchval(
+                """UPDATE users SET likes = CASE WHEN $1 = ANY(likes)
+                       THEN array_remove(likes, $1) ELSE array_append(likes, $1) END
+                   WHERE telegram_id = $2
+                   RETURNING CASE WHEN $1 = ANY(likes) THEN 1 ELSE -1 END""",
+                action_data.post_id, action_data.telegram_id
+            )
         
-        # Уведомление автору поста
-        if likes_change > 0:
-            post = await conn.fetchrow("SELECT telegram_id FROM posts WHERE id = $1", action_data.post_id)
-            if post and post["telegram_id"] != action_data.telegram_id:
-                # Проверяем настройки уведомлений автора
-                author = await conn.fetchrow(
-                    "SELECT notifications_likes FROM users WHERE telegram_id = $1",
-                    post["telegram_id"]
-                )
-                if author and author["notifications_likes"]:
-                    await send_like_notification(post["telegram_id"], action_data.post_id, user["username"])
+            # Обновляем счетчик лайков поста и сразу получаем его новую версию
+            # вместе с настройкой уведомлений автора
+            row = await conn.fetchrow(
+                """WITH updated AS (
+                       UPDATE posts SET likes_count = likes_count + $1 WHERE id = $2 RETURNING *
+                   )
+                   SELECT updated.*, author.notifications_likes AS author_notifications_likes
+                   FROM updated LEFT JOIN users author ON author.telegram_id = updated.telegram_id""",
+                likes_change, action_data.post_id
+            )
+            invalidate_posts_cache()
         
-    elif action_data.action == "favorite":
-        if action_data.post_id in user["favorites"]:
-            new_favorites = [x for x in user["favorites"] if x != action_data.post_id]
-        else:
-            new_favorites = user["favorites"] + [action_data.post_id]
-            
-        await conn.execute(
-            "UPDATE users SET favorites = $1 WHERE telegram_id = $2",
-            new_favorites, action_data.telegram_id
-        )
+            if row:
+                post = dict(row)
+                author_notifications_likes = post.pop("author_notifications_likes")
+                # Уведомление автору поста (проверяем настройки)
+                if (likes_change > 0 and author_notifications_likes
+                        and post["telegram_id"] != action_data.telegram_id):
+                    like_author_id = post["telegram_id"]
         
-    elif action_data.action == "hide":
-        if action_data.post_id not in user["hidden"]:
-            new_hidden = user["hidden"] + [action_data.post_id]
+        elif action_data.action == "favorite":
+            # Переключаем избранное на стороне БД
             await conn.execute(
-                "UPDATE users SET hidden = $1 WHERE telegram_id = $2",
-                new_hidden, action_data.telegram_id
+                """UPDATE users SET favorites = CASE WHEN $1 = ANY(favorites)
+                       THEN array_remove(favorites, $1) ELSE array_append(favorites, $1) END
+                   WHERE telegram_id = $2""",
+                action_data.post_id, action_data.telegram_id
             )
-            
-    elif action_data.action == "report":
-        if action_data.post_id not in user["reports"]:
-            new_reports = user["reports"] + [action_data.post_id]
+        
+        elif action_data.action == "hide":
             await conn.execute(
-                "UPDATE users SET reports = $1 WHERE telegram_id = $2",
-                new_reports, action_data.telegram_id
+                """UPDATE users SET hidden = array_append(hidden, $1)
+                   WHERE telegram_id = $2 AND NOT $1 = ANY(COALESCE(hidden, '{}'))""",
+                action_data.post_id, action_data.telegram_id
             )
             
-            # Увеличиваем счетчик жалоб поста
-            await conn.execute(
-                "UPDATE posts SET reports_count = reports_count + 1 WHERE id = $1",
-                action_data.post_id
+        elif action_data.action == "report":
+            # Жалоба засчитывается один раз: счетчик поста растет, только если
+            # пост добавлен в список жалоб пользователя
+            post = await conn.fetchrow(
+                """WITH reported AS (
+                       UPDATE users SET reports = array_append(reports, $1)
+                       WHERE telegram_id = $2 AND NOT $1 = ANY(COALESCE(reports, '{}'))
+                       RETURNING telegram_id
+                   )
+                   UPDATE posts SET reports_count = reports_count + 1
+                   WHERE id = $1 AND EXISTS (SELECT 1 FROM reported)
+                   RETURNING *""",
+                action_data.post_id, action_data.telegram_id
             )
             
-            # Отправляем в модерацию
-            post = await conn.fetchrow("SELECT * FROM posts WHERE id = $1", action_data.post_id)
-            post_dict = dict(post)
-            if 'created_at' in post_dict and post_dict['created_at']:
-                post_dict['created_at'] = post_dict['created_at'].isoformat()
-            if 'updated_at' in post_dict and post_dict['updated_at']:
-                post_dict['updated_at'] = post_dict['updated_at'].isoformat()
-            await send_report_to_moderation(post_dict)
+            if post:
+                invalidate_posts_cache()
+                reported = True
+    
+        # Получаем обновленный пост, если он еще не вернулся из UPDATE
+        if post is None:
+            post = await conn.fetchrow(SQL_GET_POST, action_data.post_id)
     
-    # Получаем обновленный пост
-    post = await conn.fetchrow("SELECT * FROM posts WHERE id = $1", action_data.post_id)
-    await conn.close()
+    # Уведомления и модерация - уже после возврата соединения в пул
+    if like_author_id:
+        send_like_notification(like_author_id, action_data.post_id, user["username"])
     
-    # Конвертируем datetime в строки
-    post_dict = dict(post)
-    if 'created_at' in post_dict and post_dict['created_at']:
-        post_dict['created_at'] = post_dict['created_at'].isoformat()
-    if 'updated_at' in post_dict and post_dict['updated_at']:
-        post_dict['updated_at'] = post_dict['updated_at'].isoformat()
+    post_dict = record_to_dict(post)
+    
+    if reported:
+        await send_report_to_moderation(post_dict)
     
     return post_dict
 
 # Telegram бот функции
+MODERATION_BUTTONS = (
+    ("🗑 Удалить", "delete_{id}", "id"),
+    ("🚫 Бан", "ban_{id}", "telegram_id"),
+    ("💀 Хард бан", "hardban_{id}", "telegram_id"),
+)
+
+def moderation_keyboard(post: dict) -> InlineKeyboardMarkup:
+    """Клавиатура модерации для поста"""
+    return InlineKeyboardMarkup(inline_keyboard=[[
+        InlineKeyboardButton(text=label, callback_data=data.format(id=post[key]))
+        for label, data, key in MODERATION_BUTTONS
+    ]])
+
+MODERATION_HEADERS = {
+    "new": "🆕 Новое объявление",
+    "updated": "✏️ Обновлено объявление",
+}
+
+def moderation_post_lines(post: dict) -> tuple:
+    """Общие строки карточки поста для чата модерации"""
+    return (
+        f"ID: {post['id']}",
+        f"Автор: {post['full_name']} (@{post['username']})",
+        f"Telegram ID: {post['telegram_id']}",
+        f"Описание: {post['description']}",
+    )
+
 async def send_to_moderation(post: dict, action_type: str):
     """Отправка поста в модерацию"""
-    text = f"🆕 Новое объявление" if action_type == "new" else f"✏️ Обновлено объявление"
-    text += f"\n\nID: {post['id']}\nАвтор: {post['full_name']} (@{post['username']})\n"
-    text += f"Telegram ID: {post['telegram_id']}\n"
-    text += f"Описание: {post['description']}\nКатегория: {post['category']}\n"
-    text += f"Теги: {post['city']}, {post['gender']}, {post['age']}, {post['date_tag']}"
+    text = "\n".join((
+        MODERATION_HEADERS.get(action_type, MODERATION_HEADERS["updated"]),
+        "",
+        *moderation_post_lines(post),
+        f"Категория: {post['category']}",
+        f"Теги: {post['city']}, {post['gender']}, {post['age']}, {post['date_tag']}",
+    ))
     
-    keyboard = InlineKeyboardMarkup(inline_keyboard=[
-        [
-            InlineKeyboardButton(text="🗑 Удалить", callback_data=f"delete_{post['id']}"),
-            InlineKeyboardButton(text="🚫 Бан", callback_data=f"ban_{post['telegram_id']}"),
-            InlineKeyboardButton(text="💀 Хард бан", callback_data=f"hardban_{post['telegram_id']}")
-        ]
-    ])
-    
-    await bot.send_message(MODERATION_CHAT_ID, text, reply_markup=keyboard)
+    # Отправка идет в фоне: ошибка только логируется, пост уже сохранен
+    try:
+        await bot.send_message(MODERATION_CHAT_ID, text, reply_markup=moderation_keyboard(post))
+    except Exception as e:
+        print(f"Ошибка отправки поста в модерацию: {e}")
 
 async def send_report_to_moderation(post: dict):
     """Отправка жалобы в модерацию"""
-    text = f"⚠️ Жалоба на объявление\n\nID: {post['id']}\nАвтор: {post['full_name']} (@{post['username']})\n"
-    text += f"Telegram ID: {post['telegram_id']}\n"
-    text += f"Описание: {post['description']}\nЖалоб: {post['reports_count']}"
-    
-    keyboard = InlineKeyboardMarkup(inline_keyboard=[
-        [
-            InlineKeyboardButton(text="🗑 Удалить", callback_data=f"delete_{post['id']}"),
-            InlineKeyboardButton(text="🚫 Бан", callback_data=f"ban_{post['telegram_id']}"),
-            InlineKeyboardButton(text="💀 Хард бан", callback_data=f"hardban_{post['telegram_id']}")
-        ]
-    ])
+    text = "\n".join((
+        "⚠️ Жалоба на объявление",
+        "",
+        *moderation_post_lines(post),
+        f"Жалоб: {post['reports_count']}",
+    ))
     
-    await bot.send_message(MODERATION_CHAT_ID, text, reply_markup=keyboard)
+    await bot.send_message(MODERATION_CHAT_ID, text, reply_markup=moderation_keyboard(post))
 
 async def send_notifications_to_subscribers(post: dict):
     """Отправка уведомлений о новом посте подписчикам"""
     try:
-        conn = await asyncpg.connect(DATABASE_URL)
+        async with db_pool.acquire() as conn:
+            # Отбираем только подписчиков, чьи фильтры совпадают с постом
+            subscribers = await conn.fetch(
+                SUBSCRIBERS_SQL,
+                post["telegram_id"],
+                *(post[post_key] for _, post_key in SUBSCRIPTION_FILTER_FIELDS)
+            )
         
-        # Получаем всех пользователей с настройками уведомлений
-        subscribers = await conn.fetch(
-            "SELECT telegram_id, notifications_filters FROM users WHERE notifications_filters IS NOT NULL"
+        description = post['description']
+        text = NOTIFICATION_TEXTS["new_post"].format(
+            description=description[:100] + ("..." if len(description) > 100 else ""),
+            full_name=post['full_name']
         )
-        
-        await conn.close()
-        
         for subscriber in subscribers:
-            try:
-                # Парсим фильтры подписки
-                if subscriber["notifications_filters"]:
-                    filters = json.loads(subscriber["notifications_filters"]) if isinstance(subscriber["notifications_filters"], str) else subscriber["notifications_filters"]
-                    
-                    # Проверяем соответствие фильтрам
-                    match = True
-                    if filters.get("category") and filters["category"] != "Все" and filters["category"] != post["category"]:
-                        match = False
-                    if filters.get("city") and filters["city"] != "Все" and filters["city"] != post["city"]:
-                        match = False
-                    if filters.get("gender") and filters["gender"] != "Все" and filters["gender"] != post["gender"]:
-                        match = False
-                    if filters.get("age") and filters["age"] != "Все" and filters["age"] != post["age"]:
-                        match = False
-                    if filters.get("date") and filters["date"] != "Все" and filters["date"] != post["date_tag"]:
-                        match = False
-                    
-                    # Отправляем уведомление если есть совпадение и это не автор поста
-                    if match and subscriber["telegram_id"] != post["telegram_id"]:
-                        text = f"🆕 Новое объявление!\n\n{post['description'][:100]}{'...' if len(post['description']) > 100 else ''}\n\nОт: {post['full_name']}"
-                        await bot.send_message(subscriber["telegram_id"], text)
-            except Exception as e:
-                print(f"Ошибка отправки уведомления пользователю {subscriber['telegram_id']}: {e}")
-                continue
+            notify_user(subscriber["telegram_id"], text)
                 
     except Exception as e:
         print(f"Ошибка при отправке уведомлений подписчикам: {e}")
 
-async def send_like_notification(telegram_id: int, post_id: int, liker_username: str):
-    """Уведомление о лайке"""
-    text = f"👍 Вам поставили лайк на объявление #{post_id}\nОт: @{liker_username}"
+def notify_user(telegram_id: int, text: str):
+    """Постановка уведомления пользователю в очередь, без ожидания Telegram API"""
     try:
-        await bot.send_message(telegram_id, text)
-    except:
-        pass
+        notify_queue.put_nowait((telegram_id, text))
+    except asyncio.QueueFull:
+        print(f"Очередь уведомлений переполнена, пропускаем {telegram_id}")
+
+async def notify_worker():
+    """Фоновая отправка уведомлений из очереди с ограничением частоты"""
+    while True:
+        telegram_id, text = await notify_queue.get()
+        try:
+            async with telegram_rate_limiter:
+                await bot.send_message(telegram_id, text)
+        except Exception as e:
+            print(f"Ошибка отправки уведомления пользователю {telegram_id}: {e}")
+        finally:
+            notify_queue.task_done()
+
+def send_like_notification(telegram_id: int, post_id: int, liker_username: str):
+    """Уведомление о лайке"""
+    text = NOTIFICATION_TEXTS["like"].format(post_id=post_id, username=liker_username)
+    notify_user(telegram_id, text)
 
 # Telegram команды модерации
-@dp.message(lambda message: message.chat.id == MODERATION_CHAT_ID and message.text.startswith('/'))
+@dp.message(F.chat.id == MODERATION_CHAT_ID, F.text.startswith('/'))
 async def handle_moderation_commands(message: types.Message):
     """Обработка команд модерации"""
     try:
-        command_parts = message.text.split()
-        command = command_parts[0]
+        command, *args = message.text.split()
+        handler, arg_count = MODERATION_COMMANDS.get(command, (None, 0))
         
-        if command == "/delete" and len(command_parts) > 1:
-            post_id = int(command_parts[1])
-            await delete_post(post_id, message)
-            
-        elif command == "/ban" and len(command_parts) > 1:
-            telegram_id = int(command_parts[1])
-            await ban_user(telegram_id, message)
-            
-        elif command == "/hardban" and len(command_parts) > 1:
-            telegram_id = int(command_parts[1])
-            await hardban_user(telegram_id, message)
-            
-        elif command == "/unban" and len(command_parts) > 1:
-            telegram_id = int(command_parts[1])
-            await unban_user(telegram_id, message)
-            
-        elif command == "/setlimit" and len(command_parts) > 2:
-            telegram_id = int(command_parts[1])
-            limit = int(command_parts[2])
-            await set_user_limit(telegram_id, limit, message)
-            
-        elif command == "/getlimit" and len(command_parts) > 1:
-            telegram_id = int(command_parts[1])
-            await get_user_limit(telegram_id, message)
-            
+        if handler and len(args) >= arg_count:
+            await handler(*(int(arg) for arg in args[:arg_count]), message)
         else:
             await message.answer("Доступные команды:\n/delete <post_id> - Удалить объявление\n/ban <telegram_id> - Забанить пользователя\n/hardban <telegram_id> - Забанить + удалить все посты\n/unban <telegram_id> - Разбанить пользователя\n/setlimit <telegram_id> <limit> - Установить лимит постов\n/getlimit <telegram_id> - Посмотреть лимит пользователя")
             
@@ -720,361 +829,336 @@ async def handle_moderation_buttons(callback: types.CallbackQuery):
             await callback.answer("Доступ запрещен")
             return
             
-        action, value = callback.data.split("_", 1)
+        action, _, value = callback.data.partition("_")
         
-        if action == "delete":
-            await delete_post(int(value), callback.message)
-        elif action == "ban":
-            await ban_user(int(value), callback.message)
-        elif action == "hardban":
-            await hardban_user(int(value), callback.message)
-            
-        await callback.answer()
+        handler = MODERATION_CALLBACKS.get(action)
+        if handler:
+            # Ответ на нажатие не ждет выполнения действия; ошибки действия
+            # обрабатывает moderation_action
+            await asyncio.gather(handler(int(value), callback.message), callback.answer())
+        else:
+            await callback.answer()
     except Exception as e:
         print(f"Ошибка обработки callback: {e}")
         await callback.answer("Произошла ошибка")
 
 # Функции модерации
+def moderation_action(error_log: str, error_reply: str):
+    """Общая обработка ошибок действий модерации: лог и ответ модератору"""
+    def decorator(handler):
+        @wraps(handler)
+        async def wrapper(*args):
+            try:
+                await handler(*args)
+            except Exception as e:
+                print(f"{error_log}: {e}")
+                # Сообщение модератора всегда последний аргумент
+                await args[-1].answer(f"❌ {error_reply}: {str(e)}")
+        return wrapper
+    return decorator
+
+@moderation_action("Ошибка удаления поста", "Ошибка при удалении поста")
 async def delete_post(post_id: int, message):
     """Удаление поста"""
-    try:
-        conn = await asyncpg.connect(DATABASE_URL)
-        
-        # Получаем пост
-        post = await conn.fetchrow("SELECT * FROM posts WHERE id = $1", post_id)
-        if not post:
-            await message.answer("Пост не найден")
-            await conn.close()
-            return
-        
-        # Получаем автора поста для проверки настроек уведомлений
-        author = await conn.fetchrow(
-            "SELECT notifications_system FROM users WHERE telegram_id = $1",
-            post["telegram_id"]
-        )
-        
-        # Удаляем пост
-        await conn.execute("DELETE FROM posts WHERE id = $1", post_id)
-        
-        # Удаляем из списков пользователей и обновляем счетчик постов автора
-        await conn.execute(
-            "UPDATE users SET posts = array_remove(posts, $1), "
-            "favorites = array_remove(favorites, $1), "
-            "likes = array_remove(likes, $1), "
-            "reports = array_remove(reports, $1), "
-            "hidden = array_remove(hidden, $1)",
+    async with db_pool.acquire() as conn:
+        # Удаляем пост и сразу получаем автора с его настройками уведомлений
+        post = await conn.fetchrow(
+            """WITH deleted AS (DELETE FROM posts WHERE id = $1 RETURNING telegram_id)
+               SELECT d.telegram_id, u.notifications_system
+               FROM deleted d LEFT JOIN users u ON u.telegram_id = d.telegram_id""",
             post_id
         )
+        if post:
+            invalidate_posts_cache()
         
-        # Получаем обновленную информацию об авторе
-        updated_author = await conn.fetchrow("SELECT * FROM users WHERE telegram_id = $1", post["telegram_id"])
+            # Удаляем из списков пользователей и обновляем счетчик постов автора
+            await conn.execute(SQL_REMOVE_POST_REFS, post_id)
         
-        await conn.close()
-        
-        # Уведомляем автора (проверяем настройки)
-        if author and author.get("notifications_system", True):
-            try:
-                await bot.send_message(post["telegram_id"], "❌ Ваше объявление удалено из-за нарушения")
-            except:
-                pass
-        
-        # Обновляем фронт - удаляем пост
-        await broadcast_message({
+            # Получаем обновленную информацию об авторе
+            updated_author = await conn.fetchrow(SQL_GET_USER, post["telegram_id"])
+    
+    if not post:
+        await message.answer("Пост не найден")
+        return
+    
+    discard_post_action(post_id)
+    # Уведомляем автора (проверяем настройки)
+    if post["notifications_system"]:
+        notify_user(post["telegram_id"], NOTIFICATION_TEXTS["post_deleted"])
+    # Обновляем информацию об авторе на фронте
+    if updated_author:
+        send_to_user(post["telegram_id"], {
+            "type": "user_status_updated",
+            "data": {"telegram_id": post["telegram_id"], "user_info": record_to_dict(updated_author)}
+        })
+    # Рассылка удаления и ответ модератору - параллельно
+    await asyncio.gather(
+        broadcast_message({
             "type": "post_deleted",
             "data": {"post_id": post_id}
+        }),
+        message.answer(f"✅ Пост {post_id} удален"),
+    )
+
+async def publish_user_status(telegram_id: int, user, notice: str, reply: str, message):
+    """Новый статус на фронт пользователя, уведомление в Telegram и ответ модератору"""
+    if user:
+        send_to_user(telegram_id, {
+            "type": "user_status_updated",
+            "data": {"telegram_id": telegram_id, "user_info": record_to_dict(user)}
         })
-        
-        # Обновляем информацию об авторе на фронте
-        if updated_author:
-            user_info = dict(updated_author)
-            if 'created_at' in user_info and user_info['created_at']:
-                user_info['created_at'] = user_info['created_at'].isoformat()
-            if 'updated_at' in user_info and user_info['updated_at']:
-                user_info['updated_at'] = user_info['updated_at'].isoformat()
-            
-            await broadcast_message({
-                "type": "user_status_updated",
-                "data": {"telegram_id": post["telegram_id"], "user_info": user_info}
-            })
-        
-        await message.answer(f"✅ Пост {post_id} удален")
-        
-    except Exception as e:
-        print(f"Ошибка удаления поста: {e}")
-        await message.answer(f"❌ Ошибка при удалении поста: {str(e)}")
+        # Уведомляем пользователя (проверяем настройки)
+        if user.get("notifications_system", True):
+            notify_user(telegram_id, notice)
+    await message.answer(reply)
 
+@moderation_action("Ошибка бана пользователя", "Ошибка при бане пользователя")
 async def ban_user(telegram_id: int, message):
     """Бан пользователя"""
-    try:
-        conn = await asyncpg.connect(DATABASE_URL)
-        
-        result = await conn.execute(
-            "UPDATE users SET status = 'banned' WHERE telegram_id = $1",
+    async with db_pool.acquire() as conn:
+        # Обновляем и сразу получаем новую строку пользователя
+        user = await conn.fetchrow(
+            "UPDATE users SET status = 'banned' WHERE telegram_id = $1 RETURNING *",
             telegram_id
         )
-        
-        # Получаем обновленную информацию о пользователе
-        user = await conn.fetchrow("SELECT * FROM users WHERE telegram_id = $1", telegram_id)
-        await conn.close()
-        
-        if result == "UPDATE 0":
-            await message.answer(f"❌ Пользователь {telegram_id} не найден")
-            return
-        
-        # Отправляем обновление статуса на фронт
-        if user:
-            user_info = dict(user)
-            if 'created_at' in user_info and user_info['created_at']:
-                user_info['created_at'] = user_info['created_at'].isoformat()
-            if 'updated_at' in user_info and user_info['updated_at']:
-                user_info['updated_at'] = user_info['updated_at'].isoformat()
-            
-            await broadcast_message({
-                "type": "user_status_updated",
-                "data": {"telegram_id": telegram_id, "user_info": user_info}
-            })
-        
-        # Уведомляем пользователя (проверяем настройки)
-        if user and user.get("notifications_system", True):
-            try:
-                await bot.send_message(telegram_id, "🚫 Ваш аккаунт заблокирован")
-            except:
-                pass
-        
-        await message.answer(f"✅ Пользователь {telegram_id} забанен")
-        
-    except Exception as e:
-        print(f"Ошибка бана пользователя: {e}")
-        await message.answer(f"❌ Ошибка при бане пользователя: {str(e)}")
+    
+    if not user:
+        await message.answer(f"❌ Пользователь {telegram_id} не найден")
+        return
+    
+    # Фронт, пользователь и модератор получают обновление
+    await publish_user_status(
+        telegram_id,
+        user,
+        NOTIFICATION_TEXTS["banned"],
+        f"✅ Пользователь {telegram_id} забанен",
+        message
+    )
 
+@moderation_action("Ошибка хард бана", "Ошибка при хард бане")
 async def hardban_user(telegram_id: int, message):
     """Хард бан пользователя"""
-    try:
-        conn = await asyncpg.connect(DATABASE_URL)
-        
-        # Получаем автора для проверки настроек уведомлений
-        user = await conn.fetchrow(
-            "SELECT notifications_system FROM users WHERE telegram_id = $1",
-            telegram_id
-        )
-        
-        # Получаем посты пользователя
-        user_posts = await conn.fetch(
-            "SELECT id FROM posts WHERE telegram_id = $1",
-            telegram_id
-        )
-        
-        # Удаляем все посты
-        await conn.execute("DELETE FROM posts WHERE telegram_id = $1", telegram_id)
-        
-        # Банием пользователя
-        await conn.execute(
-            "UPDATE users SET status = 'banned', posts = '{}' WHERE telegram_id = $1",
-            telegram_id
-        )
-        
-        # Удаляем посты из списков других пользователей
-        for post in user_posts:
-            await conn.execute(
-                "UPDATE users SET "
-                "favorites = array_remove(favorites, $1), "
-                "likes = array_remove(likes, $1), "
-                "reports = array_remove(reports, $1), "
-                "hidden = array_remove(hidden, $1)",
-                post["id"]
+    async with db_pool.acquire() as conn:
+        async with conn.transaction():
+            # Удаляем все посты и сразу получаем их id
+            post_ids = await conn.fetchval(
+                """WITH deleted AS (DELETE FROM posts WHERE telegram_id = $1 RETURNING id)
+                   SELECT ARRAY(SELECT id FROM deleted)""",
+                telegram_id
             )
         
-        # Получаем обновленную информацию о пользователе
-        updated_user = await conn.fetchrow("SELECT * FROM users WHERE telegram_id = $1", telegram_id)
-        
-        await conn.close()
-        
-        # Уведомляем пользователя (проверяем настройки)
-        if user and user.get("notifications_system", True):
-            try:
-                await bot.send_message(telegram_id, "💀 Ваш аккаунт заблокирован и все объявления удалены")
-            except:
-                pass
-        
-        # Обновляем фронт - удаляем посты
-        for post in user_posts:
-            await broadcast_message({
-                "type": "post_deleted",
-                "data": {"post_id": post["id"]}
-            })
-        
-        # Обновляем информацию о пользователе на фронте
-        if updated_user:
-            user_info = dict(updated_user)
-            if 'created_at' in user_info and user_info['created_at']:
-                user_info['created_at'] = user_info['created_at'].isoformat()
-            if 'updated_at' in user_info and user_info['updated_at']:
-                user_info['updated_at'] = user_info['updated_at'].isoformat()
-            
-            await broadcast_message({
-                "type": "user_status_updated",
-                "data": {"telegram_id": telegram_id, "user_info": user_info}
-            })
-        
-        await message.answer(f"✅ Пользователь {telegram_id} получил хард бан")
+            # Баним пользователя и получаем обновленную строку с настройками уведомлений
+            updated_user = await conn.fetchrow(
+                "UPDATE users SET status = 'banned', posts = '{}' WHERE telegram_id = $1 RETURNING *",
+                telegram_id
+            )
         
-    except Exception as e:
-        print(f"Ошибка хард бана: {e}")
-        await message.answer(f"❌ Ошибка при хард бане: {str(e)}")
+            # Удаляем посты из списков других пользователей одним пакетом
+            if post_ids:
+                await conn.executemany(
+                    SQL_REMOVE_POST_REFS,
+                    [(post_id,) for post_id in post_ids]
+                )
+        invalidate_posts_cache()
+    
+    for post_id in post_ids:
+        discard_post_action(post_id)
+    # Удаления постов одним пакетом кадров, статус пользователя, уведомление
+    # и ответ модератору - параллельно
+    await asyncio.gather(
+        broadcast_frames([
+            orjson.dumps({"type": "post_deleted", "data": {"post_id": post_id}}).decode()
+            for post_id in post_ids
+        ]),
+        publish_user_status(
+            telegram_id,
+            updated_user,
+            NOTIFICATION_TEXTS["hardbanned"],
+            f"✅ Пользователь {telegram_id} получил хард бан",
+            message
+        )
+    )
 
+@moderation_action("Ошибка разбана", "Ошибка при разбане")
 async def unban_user(telegram_id: int, message):
     """Разбан пользователя"""
-    try:
-        conn = await asyncpg.connect(DATABASE_URL)
-        
-        result = await conn.execute(
-            "UPDATE users SET status = 'live' WHERE telegram_id = $1",
+    async with db_pool.acquire() as conn:
+        # Обновляем и сразу получаем новую строку пользователя
+        user = await conn.fetchrow(
+            "UPDATE users SET status = 'live' WHERE telegram_id = $1 RETURNING *",
             telegram_id
         )
-        
-        # Получаем обновленную информацию о пользователе
-        user = await conn.fetchrow("SELECT * FROM users WHERE telegram_id = $1", telegram_id)
-        await conn.close()
-        
-        if result == "UPDATE 0":
-            await message.answer(f"❌ Пользователь {telegram_id} не найден")
-            return
-        
-        # Отправляем обновление статуса на фронт
-        if user:
-            user_info = dict(user)
-            if 'created_at' in user_info and user_info['created_at']:
-                user_info['created_at'] = user_info['created_at'].isoformat()
-            if 'updated_at' in user_info and user_info['updated_at']:
-                user_info['updated_at'] = user_info['updated_at'].isoformat()
-            
-            await broadcast_message({
-                "type": "user_status_updated",
-                "data": {"telegram_id": telegram_id, "user_info": user_info}
-            })
-        
-        # Уведомляем пользователя
-        if user and user.get("notifications_system", True):
-            try:
-                await bot.send_message(telegram_id, "✅ Вы разблокированы")
-            except:
-                pass
-        
-        await message.answer(f"✅ Пользователь {telegram_id} разбанен")
-        
-    except Exception as e:
-        print(f"Ошибка разбана: {e}")
-        await message.answer(f"❌ Ошибка при разбане: {str(e)}")
+    
+    if not user:
+        await message.answer(f"❌ Пользователь {telegram_id} не найден")
+        return
+    
+    # Фронт, пользователь и модератор получают обновление
+    await publish_user_status(
+        telegram_id,
+        user,
+        NOTIFICATION_TEXTS["unbanned"],
+        f"✅ Пользователь {telegram_id} разбанен",
+        message
+    )
 
+@moderation_action("Ошибка установки лимита", "Ошибка при установке лимита")
 async def set_user_limit(telegram_id: int, limit: int, message):
     """Установка лимита постов"""
-    try:
-        conn = await asyncpg.connect(DATABASE_URL)
-        
-        result = await conn.execute(
-            "UPDATE users SET post_limit = $1 WHERE telegram_id = $2",
+    async with db_pool.acquire() as conn:
+        # Обновляем и сразу получаем новую строку пользователя
+        user = await conn.fetchrow(
+            "UPDATE users SET post_limit = $1 WHERE telegram_id = $2 RETURNING *",
             limit, telegram_id
         )
-        
-        # Получаем обновленную информацию о пользователе
-        user = await conn.fetchrow("SELECT * FROM users WHERE telegram_id = $1", telegram_id)
-        await conn.close()
-        
-        if result == "UPDATE 0":
-            await message.answer(f"❌ Пользователь {telegram_id} не найден")
-            return
-        
-        # Отправляем обновление лимита на фронт
-        if user:
-            user_info = dict(user)
-            if 'created_at' in user_info and user_info['created_at']:
-                user_info['created_at'] = user_info['created_at'].isoformat()
-            if 'updated_at' in user_info and user_info['updated_at']:
-                user_info['updated_at'] = user_info['updated_at'].isoformat()
-            
-            await broadcast_message({
-                "type": "user_status_updated", 
-                "data": {"telegram_id": telegram_id, "user_info": user_info}
-            })
-        
-        # Уведомляем пользователя
-        if user and user.get("notifications_system", True):
-            try:
-                await bot.send_message(telegram_id, f"📊 Новый лимит объявлений: {limit}")
-            except:
-                pass
-        
-        await message.answer(f"✅ Лимит для {telegram_id} установлен: {limit}")
-        
-    except Exception as e:
-        print(f"Ошибка установки лимита: {e}")
-        await message.answer(f"❌ Ошибка при установке лимита: {str(e)}")
+    
+    if not user:
+        await message.answer(f"❌ Пользователь {telegram_id} не найден")
+        return
+    
+    # Фронт, пользователь и модератор получают обновление
+    await publish_user_status(
+        telegram_id,
+        user,
+        NOTIFICATION_TEXTS["limit"].format(limit=limit),
+        f"✅ Лимит для {telegram_id} установлен: {limit}",
+        message
+    )
 
+@moderation_action("Ошибка получения лимита", "Ошибка при получении лимита")
 async def get_user_limit(telegram_id: int, message):
     """Получение лимита пользователя"""
-    try:
-        conn = await asyncpg.connect(DATABASE_URL)
-        
+    async with db_pool.acquire() as conn:
         user = await conn.fetchrow(
-            "SELECT post_limit, posts FROM users WHERE telegram_id = $1",
+            "SELECT post_limit, cardinality(posts) AS posts_count FROM users WHERE telegram_id = $1",
             telegram_id
         )
-        
-        await conn.close()
-        
-        if user:
-            current_posts = len(user["posts"])
-            await message.answer(f"📊 Пользователь {telegram_id}:\nЛимит: {user['post_limit']}\nИспользовано: {current_posts}")
-        else:
-            await message.answer("Пользователь не найден")
-            
-    except Exception as e:
-        print(f"Ошибка получения лимита: {e}")
-        await message.answer(f"❌ Ошибка при получении лимита: {str(e)}")
+    
+    if user:
+        await message.answer(f"📊 Пользователь {telegram_id}:\nЛимит: {user['post_limit']}\nИспользовано: {user['posts_count']}")
+    else:
+        await message.answer("Пользователь не найден")
+
+# Команды модерации: команда -> (обработчик, число целочисленных аргументов)
+MODERATION_COMMANDS = {
+    "/delete": (delete_post, 1),
+    "/ban": (ban_user, 1),
+    "/hardban": (hardban_user, 1),
+    "/unban": (unban_user, 1),
+    "/setlimit": (set_user_limit, 2),
+    "/getlimit": (get_user_limit, 1),
+}
+
+# Кнопки модерации: префикс callback_data -> обработчик
+MODERATION_CALLBACKS = {
+    "delete": delete_post,
+    "ban": ban_user,
+    "hardban": hardban_user,
+}
 
 # API для получения всех постов
+def invalidate_posts_cache():
+    """Сброс кэша ленты после изменения постов"""
+    global posts_cache, posts_cache_generation
+    posts_cache = None
+    posts_cache_generation += 1
+
+async def load_posts(generation: int) -> List[dict]:
+    """Загрузка ленты из БД и заполнение кэша"""
+    global posts_cache, posts_cache_expires
+    async with db_pool.acquire() as conn:
+        posts = await conn.fetch("SELECT * FROM posts ORDER BY created_at DESC")
+    
+    posts_list = [record_to_dict(post) for post in posts]
+    # Не кэшируем результат, если посты изменились во время запроса
+    if generation == posts_cache_generation:
+        posts_cache = posts_list
+        posts_cache_expires = time.monotonic() + POSTS_CACHE_TTL
+    return posts_list
+
 @app.get("/api/posts")
 async def get_all_posts():
     """Получение всех постов"""
-    conn = await asyncpg.connect(DATABASE_URL)
-    posts = await conn.fetch("SELECT * FROM posts ORDER BY created_at DESC")
-    await conn.close()
+    global posts_loading_task, posts_loading_generation
     
-    # Конвертируем datetime в строки
-    posts_list = []
-    for post in posts:
-        post_dict = dict(post)
-        if 'created_at' in post_dict and post_dict['created_at']:
-            post_dict['created_at'] = post_dict['created_at'].isoformat()
-        if 'updated_at' in post_dict and post_dict['updated_at']:
-            post_dict['updated_at'] = post_dict['updated_at'].isoformat()
-        posts_list.append(post_dict)
+    if posts_cache is not None and time.monotonic() < posts_cache_expires:
+        return posts_cache
     
-    return posts_list
+    # Одновременные промахи кэша ждут одну загрузку того же поколения
+    generation = posts_cache_generation
+    if (posts_loading_task is None or posts_loading_task.done()
+            or posts_loading_generation != generation):
+        posts_loading_generation = generation
+        posts_loading_task = asyncio.create_task(load_posts(generation))
+    # shield: отмена одного ожидающего не отменяет загрузку для остальных
+    return await asyncio.shield(posts_loading_task)
 
 # Webhook для Telegram
+# Ответ всегда одинаковый, тело сериализуется один раз
+WEBHOOK_OK_BODY = orjson.dumps({"ok": True})
+
 @app.post("/webhook")
-async def webhook(update: dict):
+async def webhook(request: Request):
     """Обработка webhook от Telegram"""
-    telegram_update = types.Update(**update)
+    # Тело разбирается orjson, а не stdlib json при валидации параметра FastAPI
+    telegram_update = types.Update(**orjson.loads(await request.body()))
     await dp.feed_webhook_update(bot, telegram_update)
-    return {"ok": True}
+    return Response(content=WEBHOOK_OK_BODY, media_type="application/json")
 
 # Запуск сервера
+async def init_connection(conn: asyncpg.Connection):
+    """Настройка нового соединения пула: JSONB кодируется и декодируется через orjson"""
+    await conn.set_type_codec(
+        "jsonb",
+        encoder=lambda value: orjson.dumps(value).decode(),
+        decoder=orjson.loads,
+        schema="pg_catalog",
+    )
+
 async def on_startup():
     """Инициализация при запуске"""
+    global db_pool
+    # Задачи, завершающиеся без ожидания, выполняются сразу, без лишней итерации цикла
+    if sys.version_info >= (3, 12):
+        asyncio.get_running_loop().set_task_factory(asyncio.eager_task_factory)
+    
+    db_pool = await asyncpg.create_pool(
+        DATABASE_URL,
+        min_size=min(DB_MIN_SIZE, DB_MAX_SIZE),
+        max_size=DB_MAX_SIZE,
+        # Простаивающие сверх min_size соединения закрываются через 30 секунд
+        max_inactive_connection_lifetime=30,
+        statement_cache_size=1024,
+        max_cacheable_statement_size=16 * 1024,
+        server_settings={"jit": "off", "application_name": "six_backend"},
+        init=init_connection,
+    )
     await init_db()
+    notify_workers.extend(
+        asyncio.create_task(notify_worker()) for _ in range(TELEGRAM_SEND_CONCURRENCY)
+    )
     await bot.set_webhook(WEBHOOK_URL)
     print("🚀 Сервер запущен")
 
 async def on_shutdown():
     """Очистка при завершении"""
     await bot.delete_webhook()
+    for worker in notify_workers:
+        worker.cancel()
     await bot.session.close()
+    if db_pool:
+        await db_pool.close()
 
 app.add_event_handler("startup", on_startup)
 app.add_event_handler("shutdown", on_shutdown)
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    # uvloop и httptools входят в uvicorn[standard]
+    uvicorn.run(
+        app, host="0.0.0.0", port=8000, loop="uvloop", http="httptools", ws="websockets",
+        # Кадры клиента - небольшие JSON команды; большие кадры не нужны
+        ws_max_size=1024 * 1024,
+        ws_ping_interval=20.0,
+        ws_ping_timeout=20.0,
+    )